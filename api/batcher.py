@@ -0,0 +1,79 @@
+"""
+Micro-batching of concurrent requests into a single analyzer call.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List
+
+
+class MicroBatcher:
+    """
+    Collects texts submitted by concurrent requests for up to `max_delay_ms`
+    or `max_batch` items and processes them with one call to `process`.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[str]], Awaitable[List[Any]]],
+        max_batch: int = 32,
+        max_delay_ms: float = 10,
+    ):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, text: str) -> Any:
+        """
+        Queues a text and waits for its result.
+        """
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _resolve(self, batch: list):
+        try:
+            results = await self.process([text for text, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry each text on its own so the error only reaches the
+                # request that caused it.
+                for item in batch:
+                    await self._resolve([item])
+                return
+
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self):
+        while True:
+            await self._resolve(await self._collect())
@@ -0,0 +1,66 @@
+"""
+Content-addressed cache for analyzer predictions.
+
+Predictions are keyed by the BLAKE3 digest of the normalized comment text and
+the model identifier, and stored on disk so they are shared across workers.
+"""
+
+from typing import Any, Callable, List
+
+from blake3 import blake3
+from diskcache import Cache
+
+from api.settings import settings
+
+# Bump when the format of the cached values changes.
+CACHE_VERSION = "2"
+
+_MISSING = object()
+
+prediction_cache = Cache(settings.cache_dir)
+
+
+def make_key(text: str, model_id: str) -> bytes:
+    """
+    Builds the cache key for a text and model, ignoring case and surrounding
+    whitespace.
+    """
+
+    normalized = text.strip().lower().encode("utf-8")
+    scope = f"{CACHE_VERSION}|{model_id}".encode("utf-8")
+    return blake3(normalized + b"|" + scope).digest()
+
+
+def get_or_compute_many(
+    texts: List[str], model_id: str, compute: Callable[[List[str]], List[Any]]
+) -> List[Any]:
+    """
+    Returns the predictions for a list of texts in order, calling `compute`
+    once with only the texts that are not cached yet.
+    """
+
+    keys = [make_key(text, model_id) for text in texts]
+    results = [prediction_cache.get(key, default=_MISSING) for key in keys]
+
+    missing = {}
+    for index, (key, result) in enumerate(zip(keys, results)):
+        if result is _MISSING:
+            missing.setdefault(key, []).append(index)
+
+    if missing:
+        computed = compute([texts[indexes[0]] for indexes in missing.values()])
+
+        if len(computed) != len(missing) or any(
+            result is None for result in computed
+        ):
+            raise RuntimeError(
+                f"{model_id} returned incomplete predictions for "
+                f"{len(missing)} texts; nothing was cached"
+            )
+
+        for (key, indexes), result in zip(missing.items(), computed):
+            prediction_cache.set(key, result)
+            for index in indexes:
+                results[index] = result
+
+    return results
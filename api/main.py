@@ -2,29 +2,73 @@
 Main API module defining the FastAPI application and its endpoints.
 """
 
+import asyncio
+import codecs
 import csv
+import functools
+import itertools
+import logging
 import resource
+import string
 import time
-from io import StringIO
+from typing import Iterator, Optional
 
 import ollama
+import pyarrow as pa
 from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pyarrow import csv as pa_csv
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
+from api.batcher import MicroBatcher
+from api.cache import get_or_compute_many
 from api.models.comment import Comment, CommentList
 from api.nlp import (
-    danger_analyzer,
-    danger_analyzer_v2,
-    danger_analyzer_v3,
-    hate_analyzer,
-    sentiment_analyzer,
+    build_outputs,
+    cache_model_id,
+    get_danger_analyzer,
+    get_hate_analyzer,
+    get_sentiment_analyzer,
+    predict_in_buckets,
+    predict_probas,
 )
 from api.settings import settings
 
-limiter = Limiter(key_func=get_remote_address)
+CSV_BATCH_SIZE = 256
+
+COMMENT_FIELD_NAMES = frozenset({"comment", "content", "text", "body"})
+
+SUMMARIZE_OPTIONS = {"num_ctx": 4096, "num_predict": 400}
+
+logger = logging.getLogger(__name__)
+
+
+def split_prompt(template: str) -> list:
+    """
+    Splits a str.format template into the literal text around its replacement
+    fields, so `comments.join(parts)` matches `template.format(comments)`.
+    """
+
+    parts = [""]
+
+    for literal, field_name, _, _ in string.Formatter().parse(template):
+        parts[-1] += literal
+        if field_name is not None:
+            parts.append("")
+
+    return parts
+
+
+SUMMARIZE_PROMPT_PARTS = split_prompt(settings.summarize_prompt)
+
+ollama_client = ollama.AsyncClient()
+
+limiter = Limiter(
+    key_func=get_remote_address, storage_uri=settings.rate_limit_storage_uri
+)
 
 app = FastAPI()
 
@@ -40,6 +84,55 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def preload_summarize_model():
+    """
+    Loads the summarization model into Ollama and prefills the static part of
+    the prompt, so requests sharing that prefix reuse its cached KV entries.
+    """
+
+    try:
+        await ollama_client.chat(
+            model=settings.summarize_model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": SUMMARIZE_PROMPT_PARTS[0],
+                }
+            ],
+            keep_alive=settings.summarize_keep_alive,
+            options={**SUMMARIZE_OPTIONS, "num_predict": 1},
+        )
+    except Exception as e:
+        logger.warning("Could not preload %s: %s", settings.summarize_model, e)
+
+
+@app.on_event("startup")
+async def warmup_analyzers():
+    """
+    Loads the default analyzers and runs them on a full batch and on a single
+    text, the way requests call them, so the first request does not pay the
+    load, cold forward or compile cost.
+    """
+
+    batch = ["comentario de prueba " * (i + 1) for i in range(32)]
+
+    # Compiled models specialize batches of one even with dynamic shapes, so
+    # single comments and one-item buckets need their own warmup.
+    for texts in (batch, batch[:1]):
+        await asyncio.gather(
+            asyncio.to_thread(
+                lambda: predict_probas(get_sentiment_analyzer(), texts)
+            ),
+            asyncio.to_thread(lambda: predict_probas(get_hate_analyzer(), texts)),
+            asyncio.to_thread(
+                lambda: get_danger_analyzer("evd")(
+                    texts, batch_size=32, padding=True, truncation=True
+                )
+            ),
+        )
+
+
 def start_metrics() -> dict:
     return {
         "wall_time": time.perf_counter(),
@@ -63,19 +156,6 @@ def build_metrics(metrics_start: dict) -> dict:
     }
 
 
-def get_danger_analyzer(model: str):
-    """
-    Returns the appropriate danger analyzer based on the model name.
-    """
-
-    if model == "evd2":
-        return danger_analyzer_v2
-    elif model == "evd3":
-        return danger_analyzer_v3
-
-    return danger_analyzer
-
-
 def map_danger_label(label: str, model: str) -> str:
     """
     Maps the danger label to a descriptive value based on the model used.
@@ -96,6 +176,79 @@ def map_danger_label(label: str, model: str) -> str:
     return mapping.get(label)
 
 
+def run_analyzer(texts: list, model_id: str, predict):
+    """
+    Runs `predict` in a worker thread over the texts missing from the cache,
+    grouped into length buckets.
+    """
+
+    return asyncio.to_thread(
+        get_or_compute_many,
+        texts,
+        model_id,
+        lambda missing: predict_in_buckets(missing, predict),
+    )
+
+
+async def analyze_batch(texts: list, model: str) -> list:
+    """
+    Runs the sentiment, hate and danger analyzers over a batch of comments.
+    """
+
+    sentiment_analyzer, hate_analyzer, analyzer = await asyncio.gather(
+        asyncio.to_thread(get_sentiment_analyzer),
+        asyncio.to_thread(get_hate_analyzer),
+        asyncio.to_thread(get_danger_analyzer, model),
+    )
+
+    sentiments, hates, danger_labels = await asyncio.gather(
+        run_analyzer(
+            texts,
+            cache_model_id("sentiment", sentiment_analyzer.model),
+            functools.partial(predict_probas, sentiment_analyzer),
+        ),
+        run_analyzer(
+            texts,
+            cache_model_id("hate", hate_analyzer.model),
+            functools.partial(predict_probas, hate_analyzer),
+        ),
+        run_analyzer(
+            texts,
+            cache_model_id(model, analyzer.model),
+            lambda bucket: analyzer(
+                bucket, batch_size=32, padding=True, truncation=True
+            ),
+        ),
+    )
+    sentiments = build_outputs(sentiment_analyzer, texts, sentiments)
+    hates = build_outputs(hate_analyzer, texts, hates)
+
+    results = []
+
+    for comment_text, sentiment, hate, danger_label in zip(
+        texts, sentiments, hates, danger_labels
+    ):
+        danger = map_danger_label(danger_label["label"], model)
+
+        results.append(
+            {
+                "comment": comment_text,
+                "sentiment": sentiment,
+                "hate": hate,
+                "danger": {"label": danger_label, "description": danger},
+                "model_used": model,
+            }
+        )
+
+    return results
+
+
+comment_batchers = {
+    model: MicroBatcher(functools.partial(analyze_batch, model=model))
+    for model in ("evd", "evd2", "evd3")
+}
+
+
 @app.get("/")
 @limiter.limit("60/minute")
 async def root(request: Request):
@@ -122,19 +275,10 @@ async def analyze_comment(
 
     metrics_start = start_metrics()
 
-    sentiment = sentiment_analyzer.predict(comment.content)
-    hate = hate_analyzer.predict(comment.content)
-
-    analyzer = get_danger_analyzer(model)
-    danger_label = analyzer.predict(comment.content)[0]
-    danger = map_danger_label(danger_label["label"], model)
+    result = await comment_batchers[model].submit(comment.content)
 
     return {
-        "comment": comment.content,
-        "sentiment": sentiment,
-        "hate": hate,
-        "danger": {"label": danger_label, "description": danger},
-        "model_used": model,
+        **result,
         "metrics": build_metrics(metrics_start),
         "status": "Comment created successfully",
     }
@@ -151,9 +295,17 @@ async def compare_danger_models(request: Request, comment: Comment):
     models = ["evd", "evd2", "evd3"]
     comparisons = {}
 
-    for model_name in models:
-        analyzer = get_danger_analyzer(model_name)
-        danger_label = analyzer.predict(comment.content)[0]
+    danger_labels = await asyncio.gather(
+        *[
+            asyncio.to_thread(
+                lambda name: get_danger_analyzer(name).predict(comment.content)[0],
+                model_name,
+            )
+            for model_name in models
+        ]
+    )
+
+    for model_name, danger_label in zip(models, danger_labels):
         danger = map_danger_label(danger_label["label"], model_name)
 
         comparisons[model_name] = {
@@ -169,6 +321,90 @@ async def compare_danger_models(request: Request, comment: Comment):
     }
 
 
+def decoded_lines(stream) -> Iterator[str]:
+    """
+    Yields the lines of a binary stream decoded as UTF-8, reading each line
+    only when it is requested.
+    """
+
+    return codecs.iterdecode(iter(stream.readline, b""), "utf-8")
+
+
+def read_csv_comments(stream) -> Iterator[Optional[str]]:
+    """
+    Yields the comment column of an uploaded CSV in row order.
+
+    The header is read first with the csv module to pick the column, and only
+    that column is parsed by pyarrow, always as text. As with csv.DictReader,
+    a duplicated column name resolves to its last occurrence. Rows with a
+    different number of fields than the header cannot be placed by pyarrow
+    once quoted values may span lines, so on the first such row the rest of
+    the file is read with the csv module instead.
+    """
+
+    header = next(csv.reader(decoded_lines(stream)), [])
+    data_start = stream.tell()
+
+    if not header:
+        raise HTTPException(status_code=400, detail="Empty CSV file")
+
+    field = next(
+        (name for name in header if name.lower() in COMMENT_FIELD_NAMES), header[0]
+    )
+    index = len(header) - 1 - header[::-1].index(field)
+
+    if not stream.read(1):
+        return
+    stream.seek(data_start)
+
+    column = str(index)
+    has_invalid_rows = False
+
+    def reject_row(row):
+        nonlocal has_invalid_rows
+        has_invalid_rows = True
+        return "error"
+
+    # Rows are only yielded from complete batches, so when pyarrow stops on an
+    # invalid row everything yielded so far precedes it.
+    parsed_rows = 0
+
+    try:
+        reader = pa_csv.open_csv(
+            stream,
+            # Positional names, so duplicated headers do not clash.
+            read_options=pa_csv.ReadOptions(
+                column_names=[str(i) for i in range(len(header))],
+                use_threads=False,
+            ),
+            parse_options=pa_csv.ParseOptions(
+                newlines_in_values=True, invalid_row_handler=reject_row
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=[column],
+                column_types={column: pa.string()},
+                strings_can_be_null=False,
+            ),
+        )
+
+        for batch in reader:
+            for value in batch.column(column).to_pylist():
+                yield value
+                parsed_rows += 1
+        return
+    except pa.ArrowInvalid as e:
+        if "invalid UTF8" in str(e):
+            raise UnicodeDecodeError("utf-8", b"", 0, 1, str(e)) from e
+        if not has_invalid_rows:
+            raise
+
+    stream.seek(data_start)
+    rows = (row for row in csv.reader(decoded_lines(stream)) if row)
+
+    for row in itertools.islice(rows, parsed_rows, None):
+        yield row[index] if index < len(row) else None
+
+
 @app.post("/upload/")
 @limiter.limit("10/minute")
 async def analyze_csv(
@@ -191,53 +427,25 @@ async def analyze_csv(
             status_code=400, detail="Invalid file type. Please upload a CSV file."
         )
 
-    content = await file.read()
-
     try:
-        text_content = content.decode("utf-8")
-        csv_file = StringIO(text_content)
-        reader = csv.DictReader(csv_file)
-
-        fieldnames = reader.fieldnames
-
-        if not fieldnames:
-            raise HTTPException(status_code=400, detail="Empty CSV file")
-
-        comment_field = next(
-            (
-                name
-                for name in fieldnames
-                if name.lower() in ["comment", "content", "text", "body"]
-            ),
-            None,
-        )
-
-        if not comment_field:
-            comment_field = fieldnames[0]
-
         results = []
+        texts = []
 
-        analyzer = get_danger_analyzer(model)
-
-        for row in reader:
-            comment_text = row.get(comment_field, "").strip()
+        for value in read_csv_comments(file.file):
+            comment_text = (value or "").strip()
 
             if comment_text:
-                sentiment = sentiment_analyzer.predict(comment_text)
-                hate = hate_analyzer.predict(comment_text)
-                danger_label = analyzer.predict(comment_text)[0]
-                danger = map_danger_label(danger_label["label"], model)
-
-                results.append(
-                    {
-                        "comment": comment_text,
-                        "sentiment": sentiment,
-                        "hate": hate,
-                        "danger": {"label": danger_label, "description": danger},
-                        "model_used": model,
-                    }
-                )
+                texts.append(comment_text)
+
+            if len(texts) >= CSV_BATCH_SIZE:
+                results.extend(await analyze_batch(texts, model))
+                texts = []
+
+        if texts:
+            results.extend(await analyze_batch(texts, model))
 
+    except HTTPException:
+        raise
     except UnicodeDecodeError:
         raise HTTPException(
             status_code=400, detail="Invalid file encoding. Please use UTF-8."
@@ -254,9 +462,49 @@ async def analyze_csv(
     }
 
 
+def build_summarize_prompt(comments: list) -> tuple:
+    """
+    Builds the summarization prompt, keeping comments in order until the
+    configured character budget is reached, and returns it with the number of
+    comments included. A comment that does not fit on its own is truncated.
+    """
+
+    selected = []
+    remaining = settings.summarize_max_chars
+
+    for comment in comments:
+        if selected:
+            remaining -= 2
+            if len(comment) > remaining:
+                break
+
+        selected.append(comment[: max(remaining, 0)])
+        remaining -= len(selected[-1])
+
+    return ", ".join(selected).join(SUMMARIZE_PROMPT_PARTS), len(selected)
+
+
+async def stream_summary(first_chunk, chunks):
+    """
+    Yields the summary text deltas from an Ollama chat stream.
+    """
+
+    yield first_chunk["message"]["content"]
+
+    async for chunk in chunks:
+        yield chunk["message"]["content"]
+
+
 @app.post("/summarize/")
 @limiter.limit("5/minute")
-async def summarize_comments(request: Request, comment_list: CommentList):
+async def summarize_comments(
+    request: Request,
+    comment_list: CommentList,
+    stream: bool = Query(
+        default=False,
+        description="Stream the summary as plain text while it is generated",
+    ),
+):
     """
     Endpoint to generate an executive summary of comments using Gemma3 via Ollama.
 
@@ -268,25 +516,38 @@ async def summarize_comments(request: Request, comment_list: CommentList):
     if not comment_list.comments:
         raise HTTPException(status_code=400, detail="No comments provided")
 
-    comments_text = ", ".join(comment_list.comments)
-    prompt = settings.summarize_prompt.format(comments_text)
+    prompt, summarized_comments = build_summarize_prompt(comment_list.comments)
 
     try:
-        response = ollama.chat(
-            model="gemma3:1b",
+        chunks = await ollama_client.chat(
+            model=settings.summarize_model,
             messages=[
                 {
                     "role": "user",
                     "content": prompt,
                 }
             ],
+            stream=True,
+            keep_alive=settings.summarize_keep_alive,
+            options=SUMMARIZE_OPTIONS,
         )
+        first_chunk = await anext(chunks)
+
+        if stream:
+            return StreamingResponse(
+                stream_summary(first_chunk, chunks),
+                media_type="text/plain",
+                headers={"X-Summarized-Comments": str(summarized_comments)},
+            )
 
-        summary = response["message"]["content"]
+        summary = "".join(
+            [delta async for delta in stream_summary(first_chunk, chunks)]
+        )
 
         return {
             "summary": summary,
             "total_comments": len(comment_list.comments),
+            "summarized_comments": summarized_comments,
             "status": "Summary generated successfully",
         }
 
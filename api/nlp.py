@@ -2,20 +2,241 @@
 NLP module for sentiment and hate speech analysis using pysentimiento.
 """
 
+import os
+import threading
+from functools import lru_cache, wraps
+
+# Each worker runs its own tokenizers; their thread pools would oversubscribe
+# the CPUs shared by all workers.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+import torch
+from huggingface_hub import try_to_load_from_cache
 from pysentimiento import create_analyzer
+from pysentimiento.analyzer import AnalyzerOutput
+from pysentimiento.preprocessing import preprocess_tweet
 from transformers import pipeline
 
-sentiment_analyzer = create_analyzer(task="sentiment", lang="es")
-hate_analyzer = create_analyzer(task="hate_speech", lang="es")
+from api.settings import settings
+
+
+def available_cpus() -> int:
+    """
+    Returns the CPUs this process may use, honouring the affinity mask and the
+    cgroup CPU quota set by container limits.
+    """
+
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except OSError:
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+
+    if quota in ("max", "-1"):
+        return cpus
+
+    return max(1, min(cpus, int(quota) // int(period)))
+
+
+trainer_lock = threading.Lock()
+
+torch.set_num_threads(max(1, available_cpus() // settings.web_concurrency))
+torch.set_num_interop_threads(1)
+
+if torch.cuda.is_available():
+    GPU_DTYPE = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    PIPELINE_KWARGS = {"device": 0, "dtype": GPU_DTYPE}
+else:
+    GPU_DTYPE = None
+    PIPELINE_KWARGS = {}
+
+
+def predict_in_buckets(texts: list, predict, bucket_size: int = 32) -> list:
+    """
+    Calls `predict` on groups of texts of similar length to reduce padding,
+    returning the predictions in the original order.
+    """
+
+    order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+    results = [None] * len(texts)
+
+    for start in range(0, len(order), bucket_size):
+        bucket = order[start : start + bucket_size]
+        predictions = predict([texts[index] for index in bucket])
+
+        for index, prediction in zip(bucket, predictions):
+            results[index] = prediction
+
+    return results
+
+
+@lru_cache
+def model_revision(name_or_path: str) -> str:
+    """
+    Returns the revision a model was loaded from: the commit of its snapshot
+    in the local Hugging Face cache, or the latest modification time of the
+    files in a local model directory.
+    """
+
+    if os.path.isdir(name_or_path):
+        return str(
+            max(entry.stat().st_mtime_ns for entry in os.scandir(name_or_path))
+        )
+
+    config_path = try_to_load_from_cache(name_or_path, "config.json")
+
+    if isinstance(config_path, str):
+        return os.path.basename(os.path.dirname(config_path))
+
+    return name_or_path
+
+
+def cache_model_id(name: str, model) -> str:
+    """
+    Identifies a loaded model for the prediction cache by its revision,
+    backend and dtype, so entries are not shared across model versions or
+    numeric formats.
+    """
+
+    if isinstance(model, torch.nn.Module):
+        backend = "torch"
+        # transformers 5 no longer sets _commit_hash on the config.
+        revision = getattr(model.config, "_commit_hash", None) or model_revision(
+            model.config.name_or_path
+        )
+    else:
+        # The only ONNX model is the local export in DANGER_ONNX_DIR.
+        backend = "onnx"
+        revision = model_revision(settings.danger_onnx_dir)
+    dtype = getattr(model, "dtype", None)
+
+    return f"{name}@{revision}:{backend}:{dtype}"
+
+
+def predict_probas(analyzer, texts: list) -> list:
+    """
+    Runs a pysentimiento analyzer and keeps only the text-independent part of
+    each output, so it can be cached across case and whitespace variants.
+    """
+
+    if len(texts) == 1:
+        # A single text is one plain forward pass, without the Trainer.
+        outputs = [analyzer.predict(texts[0])]
+    else:
+        # List predictions go through transformers' Trainer, and every Trainer
+        # shares accelerate's GradientState: concurrent predicts can silently
+        # truncate each other's logits.
+        with trainer_lock:
+            outputs = analyzer.predict(texts)
+
+    if len(outputs) != len(texts):
+        raise RuntimeError(
+            f"{analyzer.task} analyzer returned {len(outputs)} predictions "
+            f"for {len(texts)} texts"
+        )
+
+    return [(output.probas, output.is_multilabel) for output in outputs]
+
+
+def build_outputs(analyzer, texts: list, predictions: list) -> list:
+    """
+    Rebuilds pysentimiento outputs for the given texts from cached
+    `predict_probas` results.
+    """
+
+    return [
+        AnalyzerOutput(
+            preprocess_tweet(text, **analyzer.preprocessing_args),
+            context=None,
+            probas=probas,
+            is_multilabel=is_multilabel,
+        )
+        for text, (probas, is_multilabel) in zip(texts, predictions)
+    ]
+
+
+def locked_cache(loader):
+    """
+    Caches a loader like `lru_cache`, holding a lock per arguments while
+    loading so concurrent first uses load the model only once.
+    """
+
+    cached = lru_cache(loader)
+    locks = {}
+    locks_guard = threading.Lock()
+
+    @wraps(loader)
+    def wrapper(*args):
+        with locks_guard:
+            lock = locks.setdefault(args, threading.Lock())
+
+        with lock:
+            return cached(*args)
+
+    return wrapper
+
+
+def optimize_analyzer(analyzer):
+    """
+    Moves a pysentimiento analyzer to the GPU in half precision when one is
+    available, and compiles it if enabled.
+    """
+
+    if GPU_DTYPE is not None:
+        analyzer.model.to("cuda", dtype=GPU_DTYPE)
+
+    if settings.compile_models:
+        analyzer.model.compile(dynamic=True)
+
+    return analyzer
+
+
+@locked_cache
+def get_sentiment_analyzer():
+    return optimize_analyzer(create_analyzer(task="sentiment", lang="es"))
+
+
+@locked_cache
+def get_hate_analyzer():
+    return optimize_analyzer(create_analyzer(task="hate_speech", lang="es"))
+
+
+@locked_cache
+def get_danger_analyzer(model: str):
+    """
+    Returns the danger analyzer pipeline for the given model name, loading it
+    on first use.
+    """
+
+    model_id = f"byandrev/{model}"
+
+    if model == "evd" and settings.danger_onnx_dir:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+
+        return pipeline(
+            "text-classification",
+            model=ORTModelForSequenceClassification.from_pretrained(
+                settings.danger_onnx_dir, file_name="model.int8.onnx"
+            ),
+            tokenizer=model_id,
+        )
 
-danger_analyzer = pipeline(
-    "text-classification", model="byandrev/evd", tokenizer="byandrev/evd"
-)
+    analyzer = pipeline(
+        "text-classification", model=model_id, tokenizer=model_id, **PIPELINE_KWARGS
+    )
 
-danger_analyzer_v2 = pipeline(
-    "text-classification", model="byandrev/evd2", tokenizer="byandrev/evd2"
-)
+    if settings.compile_models:
+        analyzer.model.compile(dynamic=True)
 
-danger_analyzer_v3 = pipeline(
-    "text-classification", model="byandrev/evd3", tokenizer="byandrev/evd3"
-)
+    return analyzer
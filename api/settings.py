@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -12,8 +13,24 @@ class Settings(BaseSettings):
 
     debug: bool = True
 
+    web_concurrency: int = 1
+
     summarize_prompt: str
 
+    summarize_model: str = "gemma3:1b"
+
+    summarize_keep_alive: str = "30m"
+
+    summarize_max_chars: int = 8192
+
+    cache_dir: str = ".cache/predictions"
+
+    rate_limit_storage_uri: str = "memory://"
+
+    danger_onnx_dir: Optional[str] = None
+
+    compile_models: bool = False
+
 
 @lru_cache
 def get_settings() -> Settings:
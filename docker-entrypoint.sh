@@ -0,0 +1,11 @@
+#!/bin/sh
+set -e
+
+# Share the GPU between workers through CUDA MPS when it is enabled.
+if [ "${CUDA_MPS:-0}" = "1" ]; then
+    if ! nvidia-cuda-mps-control -d; then
+        echo "warning: could not start the CUDA MPS daemon, continuing without it" >&2
+    fi
+fi
+
+exec "$@"
@@ -0,0 +1,33 @@
+"""
+Exports the evd danger model to ONNX and quantizes it to int8.
+
+Usage: python scripts/export_danger_onnx.py [output_dir]
+
+Point DANGER_ONNX_DIR at the output directory to serve the quantized model.
+Both the export and serving with DANGER_ONNX_DIR need the optional packages
+in requirements-onnx.txt.
+"""
+
+import sys
+from pathlib import Path
+
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from optimum.onnxruntime import ORTModelForSequenceClassification
+
+MODEL_ID = "byandrev/evd"
+
+
+def main(output_dir: str = "evd-onnx"):
+    model = ORTModelForSequenceClassification.from_pretrained(MODEL_ID, export=True)
+    model.save_pretrained(output_dir)
+
+    output = Path(output_dir)
+    quantize_dynamic(
+        output / "model.onnx",
+        output / "model.int8.onnx",
+        weight_type=QuantType.QInt8,
+    )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])